@@ -0,0 +1,323 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from typing import Any, Dict, List, Tuple
+
+# 发布缓存：生成版本清单与增量包，客户端只需下载发生变化的图层或分块
+
+JsonObj = Dict[str, Any]
+
+MANIFEST_NAME = "manifest.json"
+MAP_INFO_NAME = "map_info.json"
+DELTA_INFO_NAME = "delta.json"
+DELTA_FILES_DIR = "files"
+
+
+def file_checksum(path: str, block_size: int = 1 << 20) -> str:
+    """计算文件的sha256校验值"""
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def _all_files(manifest: JsonObj) -> JsonObj:
+    """展开清单中的所有文件及其校验值"""
+    files: JsonObj = dict(manifest.get("extra_files", {}))
+    for layer_obj in manifest.get("layers", {}).values():
+        files.update(layer_obj["files"])
+    return files
+
+
+def load_manifest(path: str) -> JsonObj | None:
+    """读取清单文件，不存在时返回None"""
+    if (not os.path.exists(path)):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class CachePublisher:
+    """
+    缓存发布器
+
+    在genLayers之后运行，为输出目录中的每个图层（以及分块图层的每个分块）计算校验值，
+    写入带版本号的清单，并与上一次发布的清单比较生成只包含变化文件的增量包
+    """
+
+    def __init__(self, outpath: str, publishpath: str):
+        self.outpath = outpath
+        self.publishpath = publishpath
+
+    def _rel_path(self, path: str) -> str:
+        return os.path.relpath(path, self.outpath).replace("\\", "/")
+
+    def _tile_dir(self, layer_obj: JsonObj) -> str:
+        """分块图层的分块缓存目录，与缓存文件同名（去掉扩展名）"""
+        return os.path.normpath(os.path.splitext(layer_obj.get("cache_path", ""))[0])
+
+    def _layer_files(self, layer_obj: JsonObj, other_layers: List[JsonObj]) -> List[str]:
+        """
+        获取图层对应的缓存文件
+        分块图层的分块缓存存放在与缓存文件同名（去掉扩展名）的目录下，每个分块单独计算校验值
+        :param other_layers: 其他图层，其缓存文件和分块目录不计入当前图层
+        """
+        files = []
+        cache_path: str = layer_obj.get("cache_path", "")
+        if (cache_path == ""):
+            return files
+        if (os.path.isfile(cache_path)):
+            files.append(cache_path)
+
+        tile_dir = self._tile_dir(layer_obj)
+        if (not os.path.isdir(tile_dir)):
+            return files
+        # 图层key中含有路径分隔符时，其他图层的缓存可能位于当前分块目录下，需要排除
+        other_files = set(os.path.normpath(obj["cache_path"]) for obj in other_layers if "cache_path" in obj)
+        other_dirs = set(self._tile_dir(obj) for obj in other_layers if "cache_path" in obj)
+        for root, dirs, names in os.walk(tile_dir):
+            dirs[:] = sorted(d for d in dirs if os.path.normpath(os.path.join(root, d)) not in other_dirs)
+            for name in sorted(names):
+                path = os.path.join(root, name)
+                if (os.path.normpath(path) not in other_files):
+                    files.append(path)
+        return files
+
+    def build_manifest(self, map_info: JsonObj, version: str) -> JsonObj:
+        """根据地图信息头生成清单"""
+        layers: JsonObj = {}
+        for layer_key in sorted(map_info.keys()):
+            files: JsonObj = {}
+            other_layers = [map_info[key] for key in map_info.keys() if key != layer_key]
+            for path in self._layer_files(map_info[layer_key], other_layers):
+                files[self._rel_path(path)] = file_checksum(path)
+            if (len(files) == 0):
+                print(f"[warn] 图层\"{layer_key}\"没有可发布的缓存文件")
+            # 图层校验值由各文件的校验值组合而成，任一分块变化都会使其改变
+            layer_sha = hashlib.sha256()
+            for rel_path in sorted(files.keys()):
+                layer_sha.update(f"{rel_path}:{files[rel_path]}\n".encode("utf-8"))
+            layers[layer_key] = {
+                "checksum": layer_sha.hexdigest(),
+                "files": files,
+            }
+
+        # 不属于任何图层的文件（包括map_info.json）都记入extra_files，保证增量包覆盖整个输出目录
+        owned = set(rel_path for layer_obj in layers.values() for rel_path in layer_obj["files"].keys())
+        extra_files: JsonObj = {}
+        for root, dirs, names in os.walk(self.outpath):
+            dirs.sort()
+            for name in sorted(names):
+                path = os.path.join(root, name)
+                rel_path = self._rel_path(path)
+                if (rel_path not in owned and rel_path != MANIFEST_NAME):
+                    extra_files[rel_path] = file_checksum(path)
+
+        return {
+            "version": version,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "layers": layers,
+            "extra_files": extra_files,
+        }
+
+    def diff_manifest(self, old_manifest: JsonObj, new_manifest: JsonObj) -> Tuple[List[str], List[str]]:
+        """
+        比较两个清单
+        :return: (新增或变化的文件, 被删除的文件)
+        """
+        old_files = _all_files(old_manifest)
+        new_files = _all_files(new_manifest)
+        old_layers: JsonObj = old_manifest.get("layers", {})
+
+        changed: List[str] = []
+        for layer_key, layer_obj in new_manifest["layers"].items():
+            # 图层校验值未变化，跳过整个图层
+            if (layer_key in old_layers and old_layers[layer_key]["checksum"] == layer_obj["checksum"]):
+                continue
+            for rel_path, checksum in layer_obj["files"].items():
+                if (old_files.get(rel_path) != checksum):
+                    changed.append(rel_path)
+        for rel_path, checksum in new_manifest.get("extra_files", {}).items():
+            if (old_files.get(rel_path) != checksum):
+                changed.append(rel_path)
+
+        removed = [rel_path for rel_path in old_files.keys() if rel_path not in new_files]
+        return sorted(changed), sorted(removed)
+
+    def write_delta(self, old_manifest: JsonObj, new_manifest: JsonObj, delta_path: str) -> JsonObj:
+        """生成增量包，包内包含增量信息与所有新增或变化的文件"""
+        changed, removed = self.diff_manifest(old_manifest, new_manifest)
+        delta_info = {
+            "base_version": old_manifest["version"],
+            "version": new_manifest["version"],
+            "changed": changed,
+            "removed": removed,
+            "manifest": new_manifest,
+        }
+
+        os.makedirs(os.path.dirname(delta_path) or ".", exist_ok=True)
+        with zipfile.ZipFile(delta_path, "w", zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr(DELTA_INFO_NAME, json.dumps(delta_info, ensure_ascii=False, indent=4))
+            for rel_path in changed:
+                zf.write(os.path.join(self.outpath, rel_path), f"{DELTA_FILES_DIR}/{rel_path}")
+
+        print(f"[info] 增量包{delta_path}：变化{len(changed)}个文件，删除{len(removed)}个文件")
+        return delta_info
+
+    def publish(self, map_info: JsonObj, version: str | None = None) -> JsonObj:
+        """
+        发布当前输出目录
+        清单写入输出目录和publishpath/<version>/，若存在上一次发布则同时生成增量包
+        """
+        if (version is None):
+            version = time.strftime("%Y%m%d%H%M%S")
+
+        version_dir = os.path.join(self.publishpath, version)
+        if (os.path.exists(os.path.join(version_dir, MANIFEST_NAME))):
+            raise Exception(f"版本{version}已发布")
+
+        latest_path = os.path.join(self.publishpath, "latest.json")
+        latest = load_manifest(latest_path)
+        old_manifest: JsonObj | None = None
+        if (latest is not None):
+            old_manifest = load_manifest(os.path.join(self.publishpath, latest["version"], MANIFEST_NAME))
+
+        new_manifest = self.build_manifest(map_info, version)
+
+        os.makedirs(version_dir, exist_ok=True)
+        for manifest_path in [os.path.join(version_dir, MANIFEST_NAME), os.path.join(self.outpath, MANIFEST_NAME)]:
+            with open(manifest_path, "w", encoding="utf-8") as f:
+                json.dump(new_manifest, f, ensure_ascii=False, indent=4)
+
+        if (old_manifest is not None):
+            delta_path = os.path.join(version_dir, f"delta_{old_manifest['version']}_{version}.zip")
+            self.write_delta(old_manifest, new_manifest, delta_path)
+        else:
+            print("[info] 未找到上一次发布的清单，跳过生成增量包")
+
+        with open(latest_path, "w", encoding="utf-8") as f:
+            json.dump({"version": version}, f, ensure_ascii=False, indent=4)
+
+        print(f"[info] 已发布版本{version}至{version_dir}")
+        return new_manifest
+
+
+def _resolve_in_dir(root_dir: str, rel_path: str) -> str | None:
+    """将相对路径解析到目录下，路径越出目录时返回None"""
+    root = os.path.realpath(root_dir)
+    path = os.path.realpath(os.path.join(root, rel_path))
+    if (os.path.commonpath([root, path]) != root or path == root):
+        return None
+    return path
+
+
+def _remove_staged(staging_dir: str) -> None:
+    """删除暂存目录及其中已解压的文件"""
+    shutil.rmtree(staging_dir, ignore_errors=True)
+
+
+def apply_delta(cache_dir: str, delta_path: str) -> bool:
+    """
+    将增量包应用到已有的缓存目录，并校验所有文件
+    :param cache_dir: 客户端缓存目录，需包含上一版本的manifest.json
+    :param delta_path: 增量包路径
+    :return: 是否成功，失败时缓存目录保持不变
+    """
+    if (not os.path.isdir(cache_dir)):
+        print(f"[Error] 缓存目录{cache_dir}不存在")
+        return False
+
+    # 暂存目录位于缓存目录下，保证与目标文件在同一文件系统，可以直接替换
+    staging_dir = tempfile.mkdtemp(prefix=".delta_", dir=cache_dir)
+    try:
+        # 先解压到暂存目录并校验所有文件，全部通过后再替换，避免中途失败留下不完整的缓存
+        staged: List[Tuple[str, str]] = []
+        try:
+            with zipfile.ZipFile(delta_path, "r") as zf:
+                delta_info: JsonObj = json.loads(zf.read(DELTA_INFO_NAME).decode("utf-8"))
+                new_manifest: JsonObj = delta_info["manifest"]
+
+                old_manifest = load_manifest(os.path.join(cache_dir, MANIFEST_NAME))
+                if (old_manifest is None or old_manifest["version"] != delta_info["base_version"]):
+                    current = None if old_manifest is None else old_manifest["version"]
+                    print(f"[Error] 增量包基于版本{delta_info['base_version']}，但缓存目录版本为{current}")
+                    return False
+
+                files = _all_files(new_manifest)
+
+                # 增量包来自网络，拒绝越出缓存目录的路径
+                resolved: JsonObj = {}
+                for rel_path in list(files.keys()) + delta_info["changed"] + delta_info["removed"]:
+                    path = _resolve_in_dir(cache_dir, rel_path)
+                    if (path is None):
+                        print(f"[Error] 增量包中的路径\"{rel_path}\"不在缓存目录内")
+                        return False
+                    resolved[rel_path] = path
+
+                for rel_path in delta_info["changed"]:
+                    tmp_path = os.path.join(staging_dir, str(len(staged)))
+                    with zf.open(f"{DELTA_FILES_DIR}/{rel_path}") as src, open(tmp_path, "wb") as dst:
+                        shutil.copyfileobj(src, dst)
+                    staged.append((tmp_path, resolved[rel_path]))
+                    if (rel_path not in files or file_checksum(tmp_path) != files[rel_path]):
+                        print(f"[Error] 增量包中的文件{rel_path}校验失败")
+                        return False
+
+            # 校验未变化的文件，它们不会被替换，因此可以在修改缓存目录之前完成
+            changed = set(delta_info["changed"])
+            for rel_path, checksum in files.items():
+                if (rel_path in changed):
+                    continue
+                path = resolved[rel_path]
+                if (not os.path.isfile(path)):
+                    print(f"[Error] 缺少文件{path}")
+                    return False
+                if (file_checksum(path) != checksum):
+                    print(f"[Error] 文件{path}校验失败")
+                    return False
+        except (zipfile.BadZipFile, KeyError, ValueError, OSError) as e:
+            print(f"[Error] 增量包{delta_path}无效，原因：{e}")
+            return False
+
+        for tmp_path, dst_path in staged:
+            os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+            os.replace(tmp_path, dst_path)
+        for rel_path in delta_info["removed"]:
+            path = resolved[rel_path]
+            if (os.path.isfile(path)):
+                os.remove(path)
+
+        with open(os.path.join(cache_dir, MANIFEST_NAME), "w", encoding="utf-8") as f:
+            json.dump(new_manifest, f, ensure_ascii=False, indent=4)
+    finally:
+        _remove_staged(staging_dir)
+
+    print(f"[info] 已将缓存目录{cache_dir}从版本{delta_info['base_version']}更新至{delta_info['version']}")
+    return True
+
+
+if __name__ == "__main__":
+    import sys
+
+    usage = """用法（在项目根目录下运行）：
+    python src/cachePublisher.py publish [version]         发布output目录
+    python src/cachePublisher.py apply <cache_dir> <delta> 将增量包应用到缓存目录"""
+
+    command = sys.argv[1] if len(sys.argv) >= 2 else ""
+    if (command == "apply" and len(sys.argv) == 4):
+        sys.exit(0 if apply_delta(sys.argv[2], sys.argv[3]) else 1)
+    elif (command == "publish" and len(sys.argv) <= 3):
+        map_info_json_path = "output/map_info.json"
+        with open(map_info_json_path, "r", encoding="utf-8") as f:
+            map_info = json.load(f)
+
+        publisher = CachePublisher("output", "publish")
+        publisher.publish(map_info, sys.argv[2] if len(sys.argv) == 3 else None)
+    else:
+        print(usage)
+        sys.exit(1)
@@ -1,11 +1,15 @@
 import copy
 import json
 import os
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import Any, Dict, List, Tuple
 
 import cv2
 import numpy as np
 
+from cachePublisher import CachePublisher
+
 KYBounds = Tuple[Tuple[float, float], Tuple[float, float]]
 CVBounds = Tuple[float, float, float, float]
 JsonObj = Dict[str, Any]
@@ -19,6 +23,10 @@ class KeypointCacheGenerator:
         self.outpath = outpath
         self.cvat_map_setting = cvat_map_setting
 
+        # 合并分块时预读的分块数量及预读图像占用的内存上限
+        self.prefetch_chunks: int = max(cvat_map_setting.get("prefetch_chunks", 4), 0)
+        self.prefetch_memory: int = int(cvat_map_setting.get("prefetch_memory_mb", 512) * 1024 * 1024)
+
         self.surf_detector = cv2.xfeatures2d.SURF()
         self.surf_detector.create(
             hessianThreshold=cvat_map_setting.get("hessianThreshold", 100),
@@ -102,9 +110,26 @@ class KeypointCacheGenerator:
         out_layer_info.pop("chunks", None)
         out_layer_info.pop("scale_img", None)
         out_layer_info.pop("scale_axes", None)
+        # 图层缓存为<outpath>/<layer_key>.dat，分块图层的分块缓存存放在<outpath>/<layer_key>/目录下，
+        # cachePublisher按此约定为图层和分块计算校验值
         out_layer_info["cache_path"] = os.path.join(self.outpath, f"{layer_key}.dat").replace("\\", "/")
         return out_layer_info
 
+    def _load_chunk(self, chunk: JsonObj, scale_img: float) -> Tuple[np.ndarray | None, int]:
+        """
+        读取并缩放单个分块，在预读线程中执行
+        :return: (缩放后的图像, 解码后原始图像的字节数)
+        """
+        img_path = os.path.join(self.respath, chunk["img_path"])
+        img = cv2.imread(img_path, cv2.IMREAD_UNCHANGED)
+        if (img is None):
+            print(f"[Error] {img_path} 不是有效的图像路径")
+            return None, 0
+
+        decoded_bytes = img.nbytes
+        img = cv2.resize(img, (int(img.shape[1] * scale_img), int(img.shape[0] * scale_img)), interpolation=cv2.INTER_AREA)
+        return img, decoded_bytes
+
         # 合并块，返回合并后的图像
     def _merge_chunks(self, layer_info: JsonObj) -> np.ndarray | None:
         scale_img: float = layer_info["scale_img"]
@@ -114,30 +139,52 @@ class KeypointCacheGenerator:
 
         merge_img: np.ndarray | None = None
 
-        for chunk in layer_info["chunks"]:
-            img_path = os.path.join(self.respath, chunk["img_path"])
-            img = cv2.imread(img_path, cv2.IMREAD_UNCHANGED)
-            if (img is None):
-                print(f"[Error] {img_path} 不是有效的图像路径")
-                return None
-
-            img = cv2.resize(img, (int(img.shape[1] * scale_img), int(img.shape[0] * scale_img)), interpolation=cv2.INTER_AREA)
-            # 当读取第一幅图片
-            if (merge_img is None):
-                merge_img = img
-                bound_merge = chunk["bound"]
-
-                continue
-            # 读取其他图像，根据坐标合并
-            bound_cur = chunk["bound"]
-            bound_old = bound_merge
-            bound_merge = self._union_bound(bound_merge, bound_cur)
-
-            # 新图像的左上角坐标
-            cur_img_tl = (int((bound_cur[0] - bound_old[0]) / scale_axes), int((bound_cur[1] - bound_old[1]) / scale_axes))
-
-            # 合并图像
-            merge_img = self._mix_img(img, merge_img, cur_img_tl)
+        chunks: JsonArray = layer_info["chunks"]
+        # 读取与缩放在后台线程中预读，混合仍按chunks的顺序进行，保证输出不变
+        pending: deque[Future] = deque()  # 已提交的预读任务，按chunks顺序排列
+        chunk_cost = 0  # 单个分块读取时的最大内存占用（解码图像与缩放图像之和），用于估算预读内存
+        next_index = 0  # 下一个待读取的分块
+        executor: ThreadPoolExecutor | None = None
+
+        try:
+            for chunk in chunks:
+                if (len(pending) > 0):
+                    img, decoded_bytes = pending.popleft().result()
+                else:
+                    # 尚无预读任务（第一个分块或预算不足以预读），在当前线程读取
+                    img, decoded_bytes = self._load_chunk(chunks[next_index], scale_img)
+                    next_index += 1
+                if (img is None):
+                    return None
+
+                # 每个预读任务都按完整解码的大小计入预算，同时限制线程数，保证同时解码的图像不超出内存上限
+                chunk_cost = max(chunk_cost, decoded_bytes + img.nbytes, 1)
+                max_ahead = min(self.prefetch_chunks, self.prefetch_memory // chunk_cost)
+                if (executor is None and max_ahead > 0):
+                    executor = ThreadPoolExecutor(max_workers=max_ahead)
+                while (executor is not None and next_index < len(chunks) and len(pending) < max_ahead):
+                    pending.append(executor.submit(self._load_chunk, chunks[next_index], scale_img))
+                    next_index += 1
+
+                # 当读取第一幅图片
+                if (merge_img is None):
+                    merge_img = img
+                    bound_merge = chunk["bound"]
+
+                    continue
+                # 读取其他图像，根据坐标合并
+                bound_cur = chunk["bound"]
+                bound_old = bound_merge
+                bound_merge = self._union_bound(bound_merge, bound_cur)
+
+                # 新图像的左上角坐标
+                cur_img_tl = (int((bound_cur[0] - bound_old[0]) / scale_axes), int((bound_cur[1] - bound_old[1]) / scale_axes))
+
+                # 合并图像
+                merge_img = self._mix_img(img, merge_img, cur_img_tl)
+        finally:
+            if (executor is not None):
+                executor.shutdown(wait=True, cancel_futures=True)
 
         return merge_img
 
@@ -209,3 +256,7 @@ if __name__ == "__main__":
     map_info_json_path = "output/map_info.json"
     with open(map_info_json_path, "w", encoding="utf-8") as f:
         json.dump(map_info, f, ensure_ascii=False, indent=4)
+
+    # 04：发布缓存，生成清单与增量包
+    publisher = CachePublisher("output", "publish")
+    publisher.publish(map_info)